@@ -1,66 +1,195 @@
+import io
 import os
 import re
+import copy
 import json
-import glob
 import time
+import hashlib
+import asyncio
+import logging
 import argparse
-from tqdm import tqdm
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+import httpx
+from tqdm.asyncio import tqdm_asyncio
 import pandas as pd
-from openai import OpenAI
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from aiolimiter import AsyncLimiter
 import PyPDF2
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Logging instead of print: plays nicely with tqdm bars and avoids a
+# synchronous stdout write per chunk/response in large runs
+log = logging.getLogger("gcc")
+
+# Extracted PDF text is cached here, keyed by content hash, so repeat runs
+# (e.g. while tuning questions_per_company) skip PDF parsing entirely
+PDF_TEXT_CACHE_DIR = os.path.join('.cache', 'pdf_text')
+
+# Precompiled patterns, hoisted so hot paths skip the re-cache lookup
+_COMPANY_CODE_RE = re.compile(r'^([A-Za-z]{2,4})[-_]')
+_YEAR_RE = re.compile(r'20\d{2}')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Structured Outputs schemas: the model is constrained to these shapes, so
+# responses never need markdown-fence stripping and always parse as JSON
+_QUESTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "question": {"type": "string"},
+        "options": {"type": "array", "items": {"type": "string"}},
+        "answer": {"type": "string", "enum": ["A", "B", "C", "D"]},
+        "difficulty": {"type": "string", "enum": ["easy", "medium", "hard"]},
+        "category": {"type": "string"}
+    },
+    "required": ["question", "options", "answer", "difficulty", "category"],
+    "additionalProperties": False
+}
+
+MCQ_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "mcq_list",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "questions": {"type": "array", "items": _QUESTION_SCHEMA}
+            },
+            "required": ["questions"],
+            "additionalProperties": False
+        }
+    }
+}
+
+MCQ_MULTI_RESPONSE_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "mcq_by_chunk",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "chunks": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "chunk_id": {"type": "string"},
+                            "questions": {"type": "array", "items": _QUESTION_SCHEMA}
+                        },
+                        "required": ["chunk_id", "questions"],
+                        "additionalProperties": False
+                    }
+                }
+            },
+            "required": ["chunks"],
+            "additionalProperties": False
+        }
+    }
+}
+
+# Map company codes in filenames to full names
+COMPANY_NAME_MAP = {
+    'BBK': 'Bank of Bahrain and Kuwait',
+    'NBB': 'National Bank of Bahrain',
+    'SIB': 'Sohar International Bank',
+    'ABK': 'Al Ahli Bank of Kuwait',
+    'NBK': 'National Bank of Kuwait',
+    'BM': 'Bank Muscat',
+    'EDO': 'Energy Development Oman',
+    'ADIB': 'Abu Dhabi Islamic Bank',
+    'FAB': 'First Abu Dhabi Bank',
+    'ENBD': 'Emirates NBD',
+    'DIB': 'Dubai Islamic Bank',
+    'CBD': 'Commercial Bank of Dubai',
+    'TAB': 'Tabreed'
+}
+
+# Special case for common abbreviations
+COMPANY_ABBREV = {
+    "First Abu Dhabi Bank": "FAB",
+    "Emirates NBD": "ENBD",
+    "Abu Dhabi Commercial Bank": "ADCB",
+    "Dubai Islamic Bank": "DIB",
+    "Emirates Islamic Bank": "EIB",
+    "Commercial Bank of Dubai": "CBD",
+    "Abu Dhabi Islamic Bank": "ADIB",
+    "Tabreed": "TAB",
+    "Sohar International Bank": "SIB",
+    "EDO": "EDO",
+    "Commercial Bank": "CBQ",
+    "Bank of Bahrain and Kuwait": "BBK",
+    "National Bank of Bahrain": "NBB",
+    "Al Ahli Bank of Kuwait": "ABK",
+    "National Bank of Kuwait": "NBK",
+    "Bank Muscat": "BM"
+}
+
+def chunk_content_key(text):
+    """
+    Hash of whitespace-normalized, lowercased text, used to detect duplicate
+    chunks (e.g. boilerplate disclaimers repeated across a company's PDFs).
+    """
+    normalized = _WHITESPACE_RE.sub(' ', text).strip().lower()
+    return hashlib.blake2b(normalized.encode(), digest_size=16).hexdigest()
+
+def write_jsonl(path, questions):
+    """
+    Write questions to a JSONL file, using orjson when available
+    (2-5x faster than stdlib json and serializes straight to bytes).
+    """
+    if orjson is not None:
+        with open(path, 'wb') as f:
+            f.writelines(orjson.dumps(question) + b'\n' for question in questions)
+    else:
+        with open(path, 'w') as f:
+            f.writelines(json.dumps(question) + '\n' for question in questions)
+
 def collect_gcc_company_pdfs(directory_path):
     """
     Collect all PDF files from the specified directory for GCC companies,
     organized by country subdirectories.
     """
-    print(f"Looking for PDFs in: {directory_path}")
+    log.info(f"Looking for PDFs in: {directory_path}")
 
     if not os.path.exists(directory_path):
-        print(f"ERROR: Directory {directory_path} does not exist!")
+        log.error(f"Directory {directory_path} does not exist!")
         return {}
 
-    # Get all country directories
-    country_dirs = [d for d in os.listdir(directory_path)
-                   if os.path.isdir(os.path.join(directory_path, d))
-                   and not d.startswith('.')]
+    # Get all country directories; scandir's DirEntry caches the stat info,
+    # so this avoids a separate isdir/is_file call per entry
+    with os.scandir(directory_path) as entries:
+        country_dirs = [entry for entry in entries
+                        if entry.is_dir() and not entry.name.startswith('.')]
 
-    print(f"Found country directories: {country_dirs}")
+    log.info(f"Found country directories: {[entry.name for entry in country_dirs]}")
 
     company_pdfs = {}
     total_pdfs = 0
 
     # Process each country directory
-    for country in country_dirs:
-        country_path = os.path.join(directory_path, country)
-        pdf_files = glob.glob(os.path.join(country_path, "*.pdf"))
+    for country_entry in country_dirs:
+        country = country_entry.name
+        with os.scandir(country_entry.path) as entries:
+            pdf_entries = [entry for entry in entries
+                           if entry.is_file() and entry.name.lower().endswith('.pdf')]
 
-        for pdf_path in pdf_files:
-            filename = os.path.basename(pdf_path)
+        for pdf_entry in pdf_entries:
+            pdf_path = pdf_entry.path
+            filename = pdf_entry.name
 
             # Extract company name from filename
-            company_code_match = re.match(r'^([A-Za-z]{2,4})[-_]', filename)
+            company_code_match = _COMPANY_CODE_RE.match(filename)
             if company_code_match:
                 company_code = company_code_match.group(1).upper()
-
-                # Map company codes to full names
-                company_name_map = {
-                    'BBK': 'Bank of Bahrain and Kuwait',
-                    'NBB': 'National Bank of Bahrain',
-                    'SIB': 'Sohar International Bank',
-                    'ABK': 'Al Ahli Bank of Kuwait',
-                    'NBK': 'National Bank of Kuwait',
-                    'BM': 'Bank Muscat',
-                    'EDO': 'Energy Development Oman',
-                    'ADIB': 'Abu Dhabi Islamic Bank',
-                    'FAB': 'First Abu Dhabi Bank',
-                    'ENBD': 'Emirates NBD',
-                    'DIB': 'Dubai Islamic Bank',
-                    'CBD': 'Commercial Bank of Dubai',
-                    'TAB': 'Tabreed'
-                }
-
-                company_name = company_name_map.get(company_code, f"{company_code} {country}")
+                company_name = COMPANY_NAME_MAP.get(company_code, f"{company_code} {country}")
             else:
                 # If no clear code, use first part of filename
                 company_name = filename.split('_')[0].replace('-', ' ').title()
@@ -75,90 +204,111 @@ def collect_gcc_company_pdfs(directory_path):
             })
             total_pdfs += 1
 
-    print(f"Found {total_pdfs} PDFs from {len(company_pdfs)} companies across {len(country_dirs)} countries")
+    log.info(f"Found {total_pdfs} PDFs from {len(company_pdfs)} companies across {len(country_dirs)} countries")
     return company_pdfs
 
-def extract_text_from_pdf(pdf_path):
+def extract_text_from_pdf(pdf_path, backend="pypdfium2"):
     """
-    Extract text from a PDF file using PyPDF2.
+    Extract text from a PDF file.
+
+    The default backend is pypdfium2 (PDFium C++ binding), which is several
+    times faster than PyPDF2's pure-Python extractor. Pass backend="pypdf2"
+    to fall back to PyPDF2; it is also used automatically when pypdfium2 is
+    not installed.
     """
     try:
+        if backend == "pypdfium2":
+            try:
+                import pypdfium2 as pdfium
+            except ImportError:
+                log.warning("pypdfium2 not installed, falling back to PyPDF2")
+                backend = "pypdf2"
+
         with open(pdf_path, 'rb') as file:
-            reader = PyPDF2.PdfReader(file)
-            text = ""
-            for page_num in range(len(reader.pages)):
-                text += reader.pages[page_num].extract_text() + "\n\n"
+            pdf_bytes = file.read()
+
+        # Check the content-addressed cache before parsing
+        cache_key = hashlib.blake2b(pdf_bytes, digest_size=16).hexdigest()
+        cache_path = os.path.join(PDF_TEXT_CACHE_DIR, f"{cache_key}.{backend}.txt")
+        if os.path.exists(cache_path):
+            # newline='' preserves the extractor's line endings exactly
+            with open(cache_path, 'r', encoding='utf-8', newline='') as f:
+                return f.read()
+
+        if backend == "pypdfium2":
+            pdf = pdfium.PdfDocument(pdf_bytes)
+            try:
+                text = "\n\n".join(page.get_textpage().get_text_range() for page in pdf)
+            finally:
+                pdf.close()
+        else:
+            reader = PyPDF2.PdfReader(io.BytesIO(pdf_bytes))
+            # Collect pages and join once; += on str is quadratic for long reports
+            pages = [page.extract_text() for page in reader.pages]
+            text = "\n\n".join(pages) + "\n\n"
+
+        # Write the cache entry atomically so a crash never leaves a partial file
+        os.makedirs(PDF_TEXT_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8', newline='') as f:
+            f.write(text)
+        os.replace(tmp_path, cache_path)
+
         return text
     except Exception as e:
-        print(f"Error extracting text from PDF: {e}")
+        log.error(f"Error extracting text from PDF: {e}")
         return None
 
 def create_chunks_from_text(text, pdf_info, chunk_size=1500, chunk_overlap=200):
     """
     Create chunks from text for processing.
     """
-    chunks = []
     company_name = pdf_info['company']
     pdf_path = pdf_info['path']
     country = pdf_info['country']
     filename = pdf_info['filename']
 
     # Extract year from filename
-    year_match = re.search(r'20\d{2}', filename)
+    year_match = _YEAR_RE.search(filename)
     report_year = year_match.group(0) if year_match else "2024"  # Default to 2024 if not found
 
     if not text:
-        print(f"Warning: No text content to create chunks from")
-        return chunks
+        log.warning("No text content to create chunks from")
+        return []
 
-    # Create chunks with overlap
-    for i in range(0, len(text), chunk_size - chunk_overlap):
-        chunk_text = text[i:i + chunk_size]
-        if len(chunk_text) < 100:  # Skip very small chunks
-            continue
+    # Create chunks with overlap; bounding the range at the last start index
+    # with 100+ characters left removes the per-iteration length test entirely
+    step = chunk_size - chunk_overlap
+    last_start = len(text) - 100
+    chunk_texts = [text[i:i + chunk_size] for i in range(0, last_start + 1, step)]
 
-        chunk_id = len(chunks) + 1
-        chunks.append({
+    chunks = [
+        {
             "text": chunk_text,
             "chunk_id": str(chunk_id),
             "source_file": filename,
             "company": company_name,
             "country": country,
             "report_year": report_year
-        })
+        }
+        for chunk_id, chunk_text in enumerate(chunk_texts, start=1)
+    ]
 
-    print(f"Created {len(chunks)} chunks from text")
+    log.info(f"Created {len(chunks)} chunks from text")
     return chunks
 
+@lru_cache(maxsize=None)
 def generate_company_code(company_name):
     """
     Generate a company code from company name (e.g., "First Abu Dhabi Bank" -> "FAB")
+
+    Pure function, memoized since it runs twice per company (processing and summary).
     """
     if not company_name:
         return "UNK"  # Unknown
 
-    # Special case for common abbreviations
-    company_abbrev = {
-        "First Abu Dhabi Bank": "FAB",
-        "Emirates NBD": "ENBD",
-        "Abu Dhabi Commercial Bank": "ADCB",
-        "Dubai Islamic Bank": "DIB",
-        "Emirates Islamic Bank": "EIB",
-        "Commercial Bank of Dubai": "CBD",
-        "Abu Dhabi Islamic Bank": "ADIB",
-        "Tabreed": "TAB",
-        "Sohar International Bank": "SIB",
-        "EDO": "EDO",
-        "Commercial Bank": "CBQ",
-        "Bank of Bahrain and Kuwait": "BBK",
-        "National Bank of Bahrain": "NBB",
-        "Al Ahli Bank of Kuwait": "ABK",
-        "National Bank of Kuwait": "NBK",
-        "Bank Muscat": "BM"
-    }
-
-    if company_name in company_abbrev:
-        return company_abbrev[company_name]
+    if company_name in COMPANY_ABBREV:
+        return COMPANY_ABBREV[company_name]
 
     # Generate abbreviation from first letters of each word
     words = company_name.split()
@@ -169,9 +319,138 @@ def generate_company_code(company_name):
 
     return code.upper()
 
-def generate_questions(data, openai_client, company_code, id_counter, num_questions=5):
+# Prompt templates, built once at import time; only the marked slots vary
+# per call, which also keeps the static prefix stable for prompt caching
+PROMPT_TEMPLATE = """
+    You are an expert in creating multiple-choice questions for financial reports.
+
+    Generate {num_questions} challenging multiple-choice questions based on {prompt_context}.
+
+    Text: {text}
+
+    For each question:
+    1. Create a clear, specific question about the content provided, which may include financial data, market position, risk factors, business strategy, or key personnel.
+    2. Provide 4 options (A, B, C, D) - include the letter prefix in each option
+    3. Indicate the correct answer (just the letter A, B, C, or D)
+    4. Assign a difficulty level (easy, medium, hard)
+    5. Categorize the question (Financial Performance, Market Position, Risk Factors, Corporate Governance, Business Strategy, Operational Metrics, Sustainability, Key Personnel)
+
+    Return a JSON object with a "questions" array; each entry has these fields:
+    - question: the question text
+    - options: array of 4 options (including "A. ", "B. ", etc. prefixes)
+    - answer: the correct option letter (A, B, C, or D)
+    - difficulty: difficulty level
+    - category: the category of the question
+    """
+
+MULTI_PROMPT_TEMPLATE = """
+    You are an expert in creating multiple-choice questions for financial reports.
+
+    The text below contains several chunks from a {country} company financial report,
+    each introduced by a "### CHUNK <id>" header.
+
+    For EACH chunk, generate {per_chunk} challenging multiple-choice questions based on its content.
+    {sections}
+
+    For each question:
+    1. Create a clear, specific question about the content provided, which may include financial data, market position, risk factors, business strategy, or key personnel.
+    2. Provide 4 options (A, B, C, D) - include the letter prefix in each option
+    3. Indicate the correct answer (just the letter A, B, C, or D)
+    4. Assign a difficulty level (easy, medium, hard)
+    5. Categorize the question (Financial Performance, Market Position, Risk Factors, Corporate Governance, Business Strategy, Operational Metrics, Sustainability, Key Personnel)
+
+    Return a JSON object with a "chunks" array, one entry per chunk, each with these fields:
+    - chunk_id: the id from the chunk's "### CHUNK" header
+    - questions: array of question objects with these fields:
+      - question: the question text
+      - options: array of 4 options (including "A. ", "B. ", etc. prefixes)
+      - answer: the correct option letter (A, B, C, or D)
+      - difficulty: difficulty level
+      - category: the category of the question
+    """
+
+# Proactive rate limiters shared by every OpenAI request; configured in main
+# from --rpm/--tpm so backoff sleeps are the exception rather than the rule
+REQUEST_LIMITER = None
+TOKEN_LIMITER = None
+
+def configure_rate_limiters(rpm, tpm):
+    """
+    Set up the shared requests-per-minute and tokens-per-minute limiters.
+    """
+    global REQUEST_LIMITER, TOKEN_LIMITER
+    REQUEST_LIMITER = AsyncLimiter(rpm, 60)
+    TOKEN_LIMITER = AsyncLimiter(tpm, 60)
+
+def format_question(question, company_name, report_year, source_file, chunk_id, force_personnel=False):
+    """
+    Convert a raw model-generated question into the JSONL record format.
+    """
+    category = question.get("category", "Miscellaneous")
+
+    # Map category to source_type
+    source_type_mapping = {
+        "Financial Performance": "financial_data",
+        "Market Position": "market_data",
+        "Risk Factors": "risk_data",
+        "Corporate Governance": "governance_data",
+        "Business Strategy": "business_strategy",
+        "Operational Metrics": "operational_data",
+        "Sustainability": "sustainability",
+        "Key Personnel": "personnel_data"
+    }
+
+    source_type = source_type_mapping.get(category, "miscellaneous")
+
+    # For personnel prompts, force the category regardless of what the model chose
+    if force_personnel and category != "Key Personnel":
+        category = "Key Personnel"
+        source_type = "personnel_data"
+
+    return {
+        "id": None,  # Assigned by the caller once all chunks have completed
+        "question": question["question"],
+        "options": question["options"],
+        "answer": question["answer"],
+        "metadata": {
+            "difficulty": question.get("difficulty", "medium"),
+            "company": company_name,
+            "report_year": report_year,
+            "source_file": source_file,
+            "source_chunk_id": chunk_id,
+            "source_type": source_type,
+            "category": category
+        }
+    }
+
+@retry(
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, APITimeoutError)),
+    wait=wait_random_exponential(min=1, max=60),
+    stop=stop_after_attempt(5),
+)
+async def create_chat_completion(openai_client, **kwargs):
+    """
+    Call the chat completions endpoint, retrying transient failures
+    (rate limits, connection errors, timeouts) with exponential backoff.
+    JSON parse errors are handled by the caller and never retried.
+
+    When the shared limiters are configured, the call first acquires a
+    request slot and an estimated token budget (roughly 4 chars/token),
+    so throughput stays just under the account limits instead of
+    bouncing off 429s. Retries re-acquire both.
+    """
+    if REQUEST_LIMITER is not None:
+        estimated_tokens = sum(len(message["content"]) for message in kwargs.get("messages", [])) // 4
+        await REQUEST_LIMITER.acquire()
+        await TOKEN_LIMITER.acquire(min(estimated_tokens, TOKEN_LIMITER.max_rate))
+    return await openai_client.chat.completions.create(**kwargs)
+
+async def generate_questions(data, openai_client, semaphore, num_questions=5):
     """
     Generate multiple-choice questions from a chunk of text that includes both financial data and key personnel information.
+
+    Runs asynchronously; the semaphore bounds how many OpenAI requests are in flight at once.
+    IDs are assigned by the caller after all chunks complete.
     """
     # Determine if this is a text chunk or personnel data
     is_chunk = isinstance(data, dict) and 'text' in data
@@ -198,113 +477,112 @@ def generate_questions(data, openai_client, company_code, id_counter, num_questi
         text = f"Information about key executives and board members at {company_name}, a company from {country}."
         prompt_context = f"key personnel at {company_name} (a company from {country})"
 
-    prompt = f"""
-    You are an expert in creating multiple-choice questions for financial reports.
+    prompt = PROMPT_TEMPLATE.format(num_questions=num_questions, prompt_context=prompt_context, text=text)
 
-    Generate {num_questions} challenging multiple-choice questions based on {prompt_context}.
+    try:
+        async with semaphore:
+            response = await create_chat_completion(
+                openai_client,
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                response_format=MCQ_RESPONSE_FORMAT,
+            )
 
-    Text: {text}
+        result = response.choices[0].message.content.strip()
 
-    For each question:
-    1. Create a clear, specific question about the content provided, which may include financial data, market position, risk factors, business strategy, or key personnel.
-    2. Provide 4 options (A, B, C, D) - include the letter prefix in each option
-    3. Indicate the correct answer (just the letter A, B, C, or D)
-    4. Assign a difficulty level (easy, medium, hard)
-    5. Categorize the question (Financial Performance, Market Position, Risk Factors, Corporate Governance, Business Strategy, Operational Metrics, Sustainability, Key Personnel)
+        # Try to parse the JSON response
+        try:
+            questions = json.loads(result)["questions"]
 
-    Format your response as a JSON array of objects with these fields:
-    - question: the question text
-    - options: array of 4 options (including "A. ", "B. ", etc. prefixes)
-    - answer: the correct option letter (A, B, C, or D)
-    - difficulty: difficulty level
-    - category: the category of the question
+            # Format questions to match the JSONL format
+            formatted_questions = [
+                format_question(question, company_name, report_year, source_file, chunk_id,
+                                force_personnel=not is_chunk)
+                for question in questions
+            ]
+
+            return formatted_questions
+        except json.JSONDecodeError as e:
+            log.warning(f"Could not parse JSON response: {result}")
+            log.warning(f"JSON error: {e}")
+            return []
 
-    IMPORTANT: Return ONLY the JSON array without any markdown formatting, code blocks, or additional text.
+    except Exception as e:
+        log.error(f"Error generating questions: {e}")
+        return []
+
+async def generate_questions_multi(chunks, openai_client, semaphore, per_chunk=5):
     """
+    Generate multiple-choice questions for several chunks in a single chat completion.
 
-    try:
-        response = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            temperature=0.7,
-        )
+    Packing chunks into one prompt trades one HTTP request for many, which helps
+    when the account is bound by requests-per-minute rather than tokens-per-minute.
+    """
+    if not chunks:
+        return []
 
-        result = response.choices[0].message.content.strip()
+    country = chunks[0]['country']
 
-        # Clean up the response if it contains markdown code blocks
-        if result.startswith("```") and "```" in result:
-            # Extract content between code blocks
-            match = re.search(r'```(?:json)?\s*([\s\S]*?)\s*```', result)
-            if match:
-                result = match.group(1).strip()
+    # Number chunks locally within the batch so IDs are unique even across PDFs
+    chunk_map = {str(i + 1): chunk for i, chunk in enumerate(chunks)}
+    sections = "\n".join(f"\n### CHUNK {batch_id}\n{chunk['text']}"
+                         for batch_id, chunk in chunk_map.items())
 
-        # Try to parse the JSON response
-        try:
-            questions = json.loads(result)
+    prompt = MULTI_PROMPT_TEMPLATE.format(country=country, per_chunk=per_chunk, sections=sections)
 
-            # Format questions to match the JSONL format
-            formatted_questions = []
+    try:
+        async with semaphore:
+            response = await create_chat_completion(
+                openai_client,
+                model="gpt-4o-mini",
+                messages=[{"role": "user", "content": prompt}],
+                temperature=0.7,
+                response_format=MCQ_MULTI_RESPONSE_FORMAT,
+            )
 
-            for question in questions:
-                id_counter += 1
-
-                category = question.get("category", "Miscellaneous")
-
-                # Map category to source_type
-                source_type_mapping = {
-                    "Financial Performance": "financial_data",
-                    "Market Position": "market_data",
-                    "Risk Factors": "risk_data",
-                    "Corporate Governance": "governance_data",
-                    "Business Strategy": "business_strategy",
-                    "Operational Metrics": "operational_data",
-                    "Sustainability": "sustainability",
-                    "Key Personnel": "personnel_data"
-                }
+        result = response.choices[0].message.content.strip()
 
-                source_type = source_type_mapping.get(category, "miscellaneous")
-
-                # If not a chunk and category is not personnel, force it to be personnel
-                if not is_chunk and category != "Key Personnel":
-                    category = "Key Personnel"
-                    source_type = "personnel_data"
-
-                formatted_question = {
-                    "id": f"{company_code}{id_counter}",
-                    "question": question["question"],
-                    "options": question["options"],
-                    "answer": question["answer"],
-                    "metadata": {
-                        "difficulty": question.get("difficulty", "medium"),
-                        "company": company_name,
-                        "report_year": report_year,
-                        "source_file": source_file,
-                        "source_chunk_id": chunk_id,
-                        "source_type": source_type,
-                        "category": category
-                    }
-                }
-                formatted_questions.append(formatted_question)
+        try:
+            entries = json.loads(result)["chunks"]
 
-            return formatted_questions, id_counter
+            # Route each entry back to its chunk's metadata via the batch-local id
+            formatted_questions = []
+            for entry in entries:
+                chunk = chunk_map.get(str(entry.get("chunk_id")))
+                if chunk is None:
+                    log.warning(f"Response referenced unknown chunk_id: {entry.get('chunk_id')}")
+                    continue
+
+                for question in entry.get("questions", []):
+                    formatted_questions.append(format_question(
+                        question, chunk['company'], chunk['report_year'],
+                        chunk['source_file'], chunk['chunk_id']
+                    ))
+
+            return formatted_questions
         except json.JSONDecodeError as e:
-            print(f"Warning: Could not parse JSON response: {result}")
-            print(f"JSON error: {e}")
-            return [], id_counter
+            log.warning(f"Could not parse JSON response: {result}")
+            log.warning(f"JSON error: {e}")
+            return []
 
     except Exception as e:
-        print(f"Error generating questions: {e}")
-        return [], id_counter
+        log.error(f"Error generating questions: {e}")
+        return []
 
-def process_company_documents(company_name, pdf_infos, output_dir, openai_client, questions_per_company=50):
+async def process_company_documents(company_name, pdf_infos, output_dir, openai_client, semaphore,
+                                    extracted_texts, questions_per_company=50):
     """
     Process all documents for a company and generate questions.
+
+    PDF text is looked up in extracted_texts (filled by the process pool in main).
+    Question generation for all chunks runs concurrently via asyncio.gather,
+    with the shared semaphore bounding in-flight OpenAI requests.
     """
-    print(f"\nProcessing documents for {company_name}...")
+    log.info(f"\nProcessing documents for {company_name}...")
 
     all_questions = []
     company_code = generate_company_code(company_name)
-    id_counter = 1000  # Start from 1000 for each company
     country = pdf_infos[0]['country']  # Assume all PDFs for a company are from the same country
 
     # Create output directory if it doesn't exist
@@ -314,105 +592,176 @@ def process_company_documents(company_name, pdf_infos, output_dir, openai_client
     country_dir = os.path.join(output_dir, country)
     os.makedirs(country_dir, exist_ok=True)
 
-    # Process each PDF
+    # Extract text and build chunks for each PDF
+    all_chunks = []
     for pdf_info in pdf_infos:
         pdf_path = pdf_info['path']
-        print(f"\nProcessing {pdf_path}...")
+        log.info(f"\nProcessing {pdf_path}...")
 
-        # Extract text from PDF
-        document_text = extract_text_from_pdf(pdf_path)
+        document_text = extracted_texts.get(pdf_path)
 
         if document_text:
-            # Create chunks from document
             pdf_info['company'] = company_name
             chunks = create_chunks_from_text(document_text, pdf_info)
-            print(f"Created {len(chunks)} chunks from document")
-
-            # Generate questions from chunks
-            questions_needed = questions_per_company - len(all_questions)
-            if questions_needed <= 0:
-                break
-
-            # Use only a subset of chunks if we have many
-            chunks_to_use = chunks[:min(5, len(chunks))]
+            log.info(f"Created {len(chunks)} chunks from document")
+
+            # Sample up to 5 chunks evenly spaced across the document; the
+            # first chunks are usually cover pages and tables of contents,
+            # which make for the weakest questions
+            stride = max(1, len(chunks) // 5)
+            all_chunks.extend(chunks[::stride][:5])
+
+    # Deduplicate chunks by normalized content so repeated boilerplate across
+    # PDFs only pays for one LLM call; duplicates get cloned answers below
+    seen_chunks = {}
+    unique_chunks = []
+    duplicate_chunks = []
+    for chunk in all_chunks:
+        key = chunk_content_key(chunk['text'])
+        if key in seen_chunks:
+            duplicate_chunks.append((chunk, key))
+        else:
+            seen_chunks[key] = chunk
+            unique_chunks.append(chunk)
+    if duplicate_chunks:
+        log.info(f"Skipping {len(duplicate_chunks)} duplicate chunks for {company_name}")
+
+    # Generate questions from all unique chunks concurrently, batching chunks per request
+    batch_size = 4
+    tasks = [
+        generate_questions_multi(unique_chunks[i:i + batch_size], openai_client, semaphore)
+        for i in range(0, len(unique_chunks), batch_size)
+    ]
+    if tasks:
+        chunk_results = await tqdm_asyncio.gather(*tasks, desc=f"Generating questions for {company_name}")
+        for questions in chunk_results:
+            all_questions.extend(questions)
+
+    # Clone questions for duplicate chunks, rewriting provenance metadata
+    if duplicate_chunks:
+        questions_by_chunk = defaultdict(list)
+        for question in all_questions:
+            metadata = question['metadata']
+            questions_by_chunk[(metadata['source_file'], metadata['source_chunk_id'])].append(question)
 
-            for chunk in tqdm(chunks_to_use, desc="Generating questions from chunks"):
-                questions_to_generate = min(5, questions_needed)
-                if questions_to_generate <= 0:
-                    break
+        for chunk, key in duplicate_chunks:
+            source = seen_chunks[key]
+            for question in questions_by_chunk[(source['source_file'], source['chunk_id'])]:
+                clone = copy.deepcopy(question)
+                clone['metadata']['source_file'] = chunk['source_file']
+                clone['metadata']['source_chunk_id'] = chunk['chunk_id']
+                all_questions.append(clone)
 
-                questions, id_counter = generate_questions(
-                    chunk, openai_client, company_code, id_counter, num_questions=questions_to_generate
-                )
-                all_questions.extend(questions)
-                questions_needed -= len(questions)
-                print(f"Generated {len(questions)} questions. Total: {len(all_questions)}/{questions_per_company}")
+    # Keep at most the requested number of questions
+    all_questions = all_questions[:questions_per_company]
 
     # Generate personnel questions if we still need more
     if len(all_questions) < questions_per_company:
         questions_needed = questions_per_company - len(all_questions)
-        print(f"Generating {questions_needed} personnel questions...")
-        personnel_questions, id_counter = generate_questions(
-            company_name, openai_client, company_code, id_counter, num_questions=questions_needed
+        log.info(f"Generating {questions_needed} personnel questions...")
+        personnel_questions = await generate_questions(
+            company_name, openai_client, semaphore, num_questions=questions_needed
         )
         all_questions.extend(personnel_questions)
 
+    # Assign IDs now that all questions are collected, so ordering is deterministic
+    id_counter = 1000  # Start from 1000 for each company
+    for question in all_questions:
+        id_counter += 1
+        question["id"] = f"{company_code}{id_counter}"
+
     # Save questions to file in country subdirectory
     output_file = os.path.join(country_dir, f"{company_name.replace(' ', '_')}_questions.jsonl")
-    with open(output_file, 'w') as f:
-        for question in all_questions:
-            f.write(json.dumps(question) + '\n')
+    write_jsonl(output_file, all_questions)
 
-    print(f"Saved {len(all_questions)} questions to {output_file}")
+    log.info(f"Saved {len(all_questions)} questions to {output_file}")
     return all_questions
 
-def main():
+async def main():
     parser = argparse.ArgumentParser(description='Generate multiple-choice questions from GCC company PDFs')
     parser.add_argument('--input_dir', type=str, default='files', help='Directory containing PDF files organized by country')
     parser.add_argument('--output_dir', type=str, default='output', help='Directory to save generated questions')
     parser.add_argument('--openai_api_key', type=str, help='OpenAI API key')
     parser.add_argument('--questions_per_company', type=int, default=50, help='Number of questions to generate per company')
+    parser.add_argument('--pdf_backend', type=str, default='pypdfium2', choices=['pypdf2', 'pypdfium2'],
+                        help='PDF text extraction backend')
+    parser.add_argument('--rpm', type=int, default=500, help='OpenAI requests-per-minute budget')
+    parser.add_argument('--tpm', type=int, default=200000, help='OpenAI tokens-per-minute budget')
     args = parser.parse_args()
 
+    configure_rate_limiters(args.rpm, args.tpm)
+
     # Initialize OpenAI client
     api_key = args.openai_api_key or os.environ.get("OPENAI_API_KEY")
     if not api_key:
-        print("Error: OpenAI API key is required. Provide it with --openai_api_key or set OPENAI_API_KEY environment variable.")
+        log.error("OpenAI API key is required. Provide it with --openai_api_key or set OPENAI_API_KEY environment variable.")
         return
 
-    openai_client = OpenAI(api_key=api_key)
-
     # Collect PDFs
     company_pdfs = collect_gcc_company_pdfs(args.input_dir)
 
     if not company_pdfs:
-        print("No PDF files found. Exiting.")
+        log.info("No PDF files found. Exiting.")
         return
 
-    # Process each company's documents
-    all_questions = []
+    # Extract text from every PDF up front, parallelized across processes since
+    # PyPDF2 decoding is CPU-bound and holds the GIL
+    pdf_paths = [pdf_info['path']
+                 for pdf_infos in company_pdfs.values()
+                 for pdf_info in pdf_infos]
+    log.info(f"Extracting text from {len(pdf_paths)} PDFs with {os.cpu_count()} workers...")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        extract = partial(extract_text_from_pdf, backend=args.pdf_backend)
+        extracted_texts = dict(zip(pdf_paths, executor.map(extract, pdf_paths)))
+
+    # One shared HTTP client for every task: an explicit connection pool keeps
+    # high concurrency from churning sockets or exhausting file descriptors
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(max_connections=50, max_keepalive_connections=20),
+        timeout=httpx.Timeout(60.0),
+    )
+    openai_client = AsyncOpenAI(api_key=api_key, http_client=http_client)
 
-    for company_name, pdf_infos in company_pdfs.items():
-        company_questions = process_company_documents(
-            company_name, pdf_infos, args.output_dir, openai_client, args.questions_per_company
-        )
+    try:
+        # Process all companies concurrently; the semaphore caps in-flight OpenAI requests
+        semaphore = asyncio.Semaphore(20)
+        tasks = [
+            process_company_documents(
+                company_name, pdf_infos, args.output_dir, openai_client, semaphore,
+                extracted_texts, args.questions_per_company
+            )
+            for company_name, pdf_infos in company_pdfs.items()
+        ]
+        company_results = await asyncio.gather(*tasks)
+    finally:
+        await http_client.aclose()
+
+    all_questions = []
+    for company_questions in company_results:
         all_questions.extend(company_questions)
 
     # Save all questions to a combined file
     combined_file = os.path.join(args.output_dir, "GCC_market_dataset.jsonl")
-    with open(combined_file, 'w') as f:
-        for question in all_questions:
-            f.write(json.dumps(question) + '\n')
+    write_jsonl(combined_file, all_questions)
+
+    log.info(f"\nProcessing complete! Generated {len(all_questions)} questions total.")
+    log.info(f"Combined output saved to {combined_file}")
 
-    print(f"\nProcessing complete! Generated {len(all_questions)} questions total.")
-    print(f"Combined output saved to {combined_file}")
+    # Group questions and collect categories by company in one pass instead
+    # of rescanning all_questions for every company
+    questions_by_company = defaultdict(list)
+    categories_by_company = defaultdict(set)
+    for question in all_questions:
+        metadata = question['metadata']
+        questions_by_company[metadata['company']].append(question)
+        categories_by_company[metadata['company']].add(metadata.get('category', 'Unknown'))
 
     # Create a summary DataFrame
     summary_data = []
     for company_name, pdf_infos in company_pdfs.items():
         company_code = generate_company_code(company_name)
         country = pdf_infos[0]['country']
-        company_questions = [q for q in all_questions if q['metadata']['company'] == company_name]
+        company_questions = questions_by_company[company_name]
 
         summary_data.append({
             'Company': company_name,
@@ -420,16 +769,17 @@ def main():
             'Country': country,
             'PDFs Processed': len(pdf_infos),
             'Questions Generated': len(company_questions),
-            'Categories': ', '.join(sorted(set(q['metadata'].get('category', 'Unknown') for q in company_questions)))
+            'Categories': ', '.join(sorted(categories_by_company[company_name]))
         })
 
     summary_df = pd.DataFrame(summary_data)
     summary_file = os.path.join(args.output_dir, "processing_summary.csv")
     summary_df.to_csv(summary_file, index=False)
-    print(f"Summary saved to {summary_file}")
+    log.info(f"Summary saved to {summary_file}")
 
 if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
     start_time = time.time()
-    main()
+    asyncio.run(main())
     elapsed_time = time.time() - start_time
-    print(f"Total execution time: {elapsed_time:.2f} seconds")
\ No newline at end of file
+    log.info(f"Total execution time: {elapsed_time:.2f} seconds")
\ No newline at end of file